@@ -26,6 +26,12 @@ def main():
                       patientDataDir = config["patientDataDir"],
                       dbPath = config["routineSeqDB"],
                       captureCols = config["captureCols"],
+                      captureDtypes = config.get("captureDtypes"),
+                      rowFilter = config.get("rowFilter"),
+                      pathMap = config.get("pathMap"),
+                      sortBy = config.get("sortBy", ["date", "strain"]),
+                      sortMaxRows = config.get("sortMaxRows", 1000000),
+                      cacheDir = config.get("cacheDir"),
                       output = args.output)
     
 if __name__ == '__main__':
@@ -1,8 +1,100 @@
 import pandas as pd, os, shutil, re, os
 import covid_nextstrain_collector.searchTools as st
+import covid_nextstrain_collector.indexTools as it
 from pathlib import Path
-from alive_progress import alive_bar
-import datetime
+from covid_nextstrain_collector.progress import progressBar
+import datetime, itertools
+
+# dtype for captured columns not listed in the 'captureDtypes' config
+DEFAULT_DTYPE = "string[pyarrow]"
+
+def resolveDtypes(cols: dict, dtypes: dict = None, default: str = DEFAULT_DTYPE):
+    """Builds the dtype mapper for reading captured columns. Since files are read before renaming, 
+    each dtype is keyed by both the input and output column names.
+    :param cols: Columns to capture & rename
+    :param dtypes: dtypes by output column name (ie. {"region": "category"}), defaults to None
+    :param default: dtype for columns not in dtypes, defaults to DEFAULT_DTYPE
+    :return: A dict of column to dtype
+    """
+    dtypes = dtypes or {}
+    out = {}
+    for inCol, outCol in cols.items():
+        out[inCol] = out[outCol] = dtypes.get(outCol, dtypes.get(inCol, default))
+    return out
+
+def concatCompact(dfs: list[pd.DataFrame], dtypes: dict = None):
+    """Concatenates DataFrames without losing categorical columns to object, by first unifying their categories.
+    :param dfs: The DataFrames to concatenate
+    :param dtypes: The dtypes to restore for columns missing from some DataFrames, defaults to None
+    :return: The concatenated DataFrame
+    """
+    catCols = {col for df in dfs for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    for col in catCols:
+        cats = [df[col].cat.categories for df in dfs if col in df.columns]
+        cats = cats[0].append(cats[1:]).unique() if len(cats) > 1 else cats[0]
+        dtype = pd.CategoricalDtype(cats)
+        dfs = [df.astype({col: dtype}) if col in df.columns else df for df in dfs]
+    df = pd.concat(dfs, ignore_index=True)
+    if dtypes:
+        df = df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns and str(df[col].dtype) != str(dtype)})
+    return df
+
+def filterRows(df: pd.DataFrame, rowFilter: dict, cols: dict = {}):
+    """Keeps the rows that pass all conditions of a row filter. Conditions on columns not in df are ignored.
+    :param df: The DataFrame to filter
+    :param rowFilter: Conditions by output column name. Either a list of values to keep (ie. {"region": ["North"]}), 
+        or a range with keys 'min' and/or 'max' (ie. {"date": {"min": "2023-01-01"}}). Ranges on date columns 
+        can instead use 'months' to keep the last N months. Rows with missing or unparsable values fail ranges.
+    :param cols: Columns to capture & rename, used to find the input names of each column. Several input columns 
+        can map to the same output column, and whichever is in df is used.
+    :return: The filtered DataFrame
+    """
+    inputCols = {}
+    for inCol, outCol in cols.items(): inputCols.setdefault(outCol, []).append(inCol)
+    keep = pd.Series(True, index = df.index)
+    for col, condition in rowFilter.items():
+        name = col if col in df.columns else next((inCol for inCol in inputCols.get(col, []) if inCol in df.columns), None)
+        if name is None: continue
+        if isinstance(condition, dict):
+            if 'date' in col.lower():
+                values = pd.to_datetime(df[name].astype(str), errors='coerce', dayfirst=False)
+                parse = pd.Timestamp
+                if "months" in condition: keep &= values >= pd.Timestamp.now().normalize() - pd.DateOffset(months = int(condition["months"]))
+            else:
+                values = pd.to_numeric(df[name].astype(str), errors='coerce')
+                parse = float
+            if "min" in condition: keep &= values >= parse(condition["min"])
+            if "max" in condition: keep &= values <= parse(condition["max"])
+        else:
+            keep &= df[name].isin(condition if isinstance(condition, list) else [condition])
+    return df[keep]
+
+def importDataFiles(files: list[str], cols: dict, dtypes: dict = None, rowFilter: dict = None, cacheDir: str = None, chunksize: int = 100000, verbose = True):
+    """Imports and concatenates data files. Delimited files are read in chunks and the row filter is applied to each 
+    chunk, so filtered rows are never concatenated.
+    :param files: Paths to the files to import. Can be any format of: .tsv, .csv, or .xlsx.
+    :param cols: Columns to capture & rename. Columns are not renamed here.
+    :param dtypes: dtypes of the captured columns by output name. Others are read as DEFAULT_DTYPE.
+    :param rowFilter: Conditions rows must pass. See filterRows.
+    :param cacheDir: Folder to cache converted .xlsx files in
+    :param chunksize: Number of rows to read at once from delimited files, defaults to 100000
+    :param verbose: Be chatty
+    :return: A DataFrame of all imported rows
+    """
+    dtypes = resolveDtypes(cols, dtypes)
+    captured = set(cols.keys()).union(cols.values())
+    data = []
+    for file in files:
+        if verbose: print(f"   Reading: {Path(file).stem}")
+        reader = st.importToDataFrame(file, cacheDir = cacheDir, chunksize = chunksize, index_col=False, low_memory=True, 
+                                      encoding_errors='replace', dtype=dtypes, on_bad_lines='skip',
+                                      usecols = lambda col: col in captured)
+        chunks = [reader] if isinstance(reader, pd.DataFrame) else reader
+        for chunk in chunks:
+            data.append(chunk if rowFilter is None else filterRows(chunk, rowFilter, cols))
+        if not isinstance(reader, pd.DataFrame): reader.close()
+
+    return concatCompact(data, dtypes)
 
 def collateCOVIDdata(seqData: pd.DataFrame, patientData: pd.DataFrame, matchCol:str = None):
     """Collates COVID sequencing data and metadata. Will drop duplicate samples based on the matchCol.
@@ -11,18 +103,20 @@ def collateCOVIDdata(seqData: pd.DataFrame, patientData: pd.DataFrame, matchCol:
     :param matchCol: The column to match the data on
     :return: A collated DataFrame
     """    
-    accessions = seqData[matchCol].values.tolist()
-    metadata = patientData[patientData[matchCol].isin(accessions)]
+    metadata = patientData[patientData[matchCol].isin(seqData[matchCol])]
     seqData.drop_duplicates(subset=[matchCol], inplace=True)
     metadata.drop_duplicates(subset=[matchCol], inplace=True)
     seqData = seqData.merge(metadata, on = matchCol)
     return seqData
 
-def getPatientMetadata(patientDataDir:str, cols: dict, verbose = True):
+def getPatientMetadata(patientDataDir:str, cols: dict, dtypes: dict = None, rowFilter: dict = None, cacheDir: str = None, verbose = True):
     """Retrieves patient metadata 
     :param patientDataDir: Path to the customer tab data
     :param cols: Columns to capture & rename
     :param renameCols: Mapper to rename columns
+    :param dtypes: dtypes of the captured columns by output name. Others are read as DEFAULT_DTYPE.
+    :param rowFilter: Conditions rows must pass to be kept. See filterRows.
+    :param cacheDir: Folder to cache converted .xlsx files in
     :param verbose: Be chatty
     :return: DataFrame with combined and subsetted data
     """    
@@ -32,31 +126,29 @@ def getPatientMetadata(patientDataDir:str, cols: dict, verbose = True):
     patientDataFiles = st.generateFlatFileDB(dir = patientDataDir)
     patientDataFiles = st.searchFlatFileDB(patientDataFiles, searchTerms="lab_covid19_cust_tab_output")  
     
-    metadata = []
-    for file in patientDataFiles:
-        if verbose: print(f"   Reading: {Path(file).stem}")
-        metadata.append(st.importToDataFrame(file, index_col=False, low_memory=True, encoding_errors='replace', 
-                                             dtype="str", on_bad_lines='skip',
-                                             usecols = lambda col: col in list(cols.values()) + list(cols.keys())))
+    metadata = importDataFiles(patientDataFiles, cols = cols, dtypes = dtypes, rowFilter = rowFilter, cacheDir = cacheDir, verbose = verbose)
 
     if verbose: print(f"Collating patient metadata...")
-    metadata = pd.concat(metadata, ignore_index=True)
     metadata = metadata.rename(columns = cols)
     metadata = metadata[metadata.columns.intersection(list(cols.values()))]
 
     if 'age' in metadata.columns:
         bins = [0,20,40,60,80,100,1000]
         labels = ['0-20','20-40','40-60','60-80','80-100','100+']
-        metadata['age'] = pd.to_numeric(metadata['age'],errors='coerce')
+        metadata['age'] = pd.to_numeric(metadata['age'].astype(str),errors='coerce')
         metadata['age'] = pd.cut(metadata['age'], bins=bins, labels=labels, right=False)
 
     return metadata
 
-def getSeqData(seqDataPath:str, dbPath: str, cols: dict, verbose = True):
+def getSeqData(seqDataPath:str, dbPath: str, cols: dict, dtypes: dict = None, rowFilter: dict = None, pathMap: dict = None, cacheDir: str = None, verbose = True):
     """Retrieves BNexport files. 
     :param seqDataPath: Path to the BNexport directory. Can be any format of: .tsv, .csv, or .xlsx.
     :param dbPath: Path to flat file database
     :param cols: Columns to capture & rename
+    :param dtypes: dtypes of the captured columns by output name. Others are read as DEFAULT_DTYPE.
+    :param rowFilter: Conditions rows must pass to be kept. See filterRows.
+    :param pathMap: Path prefixes to replace in the paths read from the flat file database
+    :param cacheDir: Folder to cache converted .xlsx files in
     :param verbose: Be chatty
     :return: DataFrame with sequencing data
     """    
@@ -65,64 +157,141 @@ def getSeqData(seqDataPath:str, dbPath: str, cols: dict, verbose = True):
     
     seqDataFiles = st.generateFlatFileDB(seqDataPath)  
     
-    seqData = []
-    for file in seqDataFiles:
-        if verbose: print(f"   Reading: {Path(file).stem}")
-        seqData.append(st.importToDataFrame(file, index_col=False, low_memory=True, encoding_errors='replace', 
-                                             dtype="str", on_bad_lines='skip',
-                                             usecols = lambda col: col in list(cols.values()) + list(cols.keys())))
+    seqData = importDataFiles(seqDataFiles, cols = cols, dtypes = dtypes, rowFilter = rowFilter, cacheDir = cacheDir, verbose = verbose)
         
     if verbose: print(f"Collating sequencing metadata...")
-    seqData = pd.concat(seqData, ignore_index=True)
 
-    seqData = addFASTApaths(seqData, dbPath)    
+    seqData = addFASTApaths(seqData, dbPath, pathMap = pathMap)    
     seqData = seqData.rename(columns = cols)
     seqData = seqData[seqData.columns.intersection(list(cols.values()))]
 
     return seqData
 
-def addFASTApaths(seqData:pd.DataFrame, dbPath:str, verbose = True):
+def addFASTApaths(seqData:pd.DataFrame, dbPath:str, processes: int = None, pathMap: dict = None, verbose = True):
     """Adds FASTA paths to seqData
     :param seqData: DataFrame of sequencing data. Must have column named 'fasta'.
     :param dbPath: Path to flat file database
+    :param processes: Number of processes to search the database with, defaults to all CPUs
+    :param pathMap: Path prefixes to replace in the paths read from the flat file database (ie. {"/mnt/data/": "/data/"})
     :param verbose: Be chatty, defaults to True
-    :return: seqData with additional paths to all FASTA files in column 'fastaPath'
+    :return: seqData with additional paths to all FASTA files in column 'fastaPath'. If a file is found more than once, 
+        copies that exist and are not empty are preferred, then paths containing 'consensus', then the first path alphabetically.
     """    
     if verbose: print(f"\nRetrieving FASTA files...")
     if "fasta" not in seqData.columns: raise KeyError("Column 'fasta' does not exist in the seqData.")
     # dbPath = st.generateFlatFileDB(dbPath, outFile="./db.txt")
-    fastas = st.searchFlatFileDB(dbPath, includeTerms = seqData["fasta"].values.tolist())
+    fastas = st.searchFlatFileDB(dbPath, includeTerms = seqData["fasta"].values.tolist(), processes = processes, pathMap = pathMap)
     fastas = pd.DataFrame(fastas, columns =['fastaPath'])
     fastas['fasta'] = fastas['fastaPath'].transform(lambda path: os.path.basename(path))
-    weights = fastas['fasta'].transform(lambda path: 1000000000 if bool(re.search('consensus', path)) else 1)
-    fastas = fastas.groupby('fasta').sample(weights = weights.tolist()).reset_index()
+    fastas = fastas.astype(DEFAULT_DTYPE)
+    fastas['consensus'] = fastas['fastaPath'].str.contains('consensus', regex=False)
+    # Only check the copies of files found more than once, so a missing or empty copy can't hide a good one. The rest are checked by validateFASTApaths.
+    fastas['invalid'] = False
+    dupes = fastas['fasta'].duplicated(keep=False)
+    if dupes.any():
+        checked, _ = validateFASTApaths(fastas[dupes], dropInvalid = False, verbose = False)
+        fastas.loc[dupes, 'invalid'] = checked['fastaStatus'] != "ok"
+    fastas = fastas.sort_values(['fasta', 'invalid', 'consensus', 'fastaPath'], ascending=[True, True, False, True], kind='mergesort')
+    fastas = fastas.drop_duplicates(subset='fasta').drop(columns=['consensus', 'invalid']).reset_index(drop=True)
     seqData = seqData.merge(fastas,how="right",on="fasta")
-    # seqData = seqData[seqData["fastaPath"].apply(os.path.isfile)]
     return seqData
 
-def writeSequences(outFile: str, seqData: pd.DataFrame, stripMetadata = True, verbose = True) -> None:
+def validateFASTApaths(seqData: pd.DataFrame, threads: int = 32, dropInvalid = True, verbose = True):
+    """Checks that each FASTA file exists and is not empty. Files are checked concurrently as stat calls are slow on network storage.
+    :param seqData: DataFrame of sequencing data. Must have column named 'fastaPath'.
+    :param threads: The number of concurrent checks, defaults to 32
+    :param dropInvalid: Drop rows with missing or empty files? Otherwise they are flagged in column 'fastaStatus'. Defaults to True
+    :param verbose: Be chatty, defaults to True
+    :return: The validated seqData, and a dict of the number of files that are 'ok', 'missing' and 'empty'
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import stat
+
+    def fileSize(path):
+        try:
+            info = os.stat(path)
+            return info.st_size if stat.S_ISREG(info.st_mode) else -1
+        except (OSError, TypeError, ValueError):
+            return -1
+
+    if verbose: print(f"\nValidating FASTA files...")
+    if "fastaPath" not in seqData.columns: raise KeyError("Column 'fastaPath' does not exist in the seqData.")
+    with ThreadPoolExecutor(max_workers = threads) as executor:
+        sizes = list(executor.map(fileSize, seqData["fastaPath"].astype(object)))
+
+    status = pd.Series(["missing" if size < 0 else "empty" if size == 0 else "ok" for size in sizes], index = seqData.index)
+    counts = {key: int((status == key).sum()) for key in ["ok", "missing", "empty"]}
+    if dropInvalid:
+        seqData = seqData[status == "ok"]
+    else:
+        seqData = seqData.assign(fastaStatus = status.astype("category"))
+    return seqData, counts
+
+def writeSequences(outFile: str, seqData: pd.DataFrame | str, stripMetadata = True, index = True, verbose = True) -> None:
     """Writes a list of FASTA files to a single file. 
     :param outFile: The path to the output file. Will overwrite or be created if it doesn't exist.
-    :param keys: The dataframe representing samples. Must have column 'Key' and 'fastaPath'
+    :param seqData: The samples, as a DataFrame or the path to a Parquet file of them (ie. from externalSortRecords). Must have columns 'strain' and 'fastaPath'
     :param stripMetadata: Remove metadata from header?, defaults to True
+    :param index: Also write a samtools-compatible index to outFile + '.fai'?, defaults to True
     :param verbose: Print progress messages?, defaults to True
     :return: Nothing
     """
     print("\nGenerating sequences.fasta...")
-    with alive_bar(total = len(seqData), title="Writing FASTAs...", unknown="dots_waves", disable = not verbose) as bar:
+    fai = []
+    with progressBar(total = countRecords(seqData), title="Writing FASTAs...", verbose = verbose) as bar:
         with open(outFile,'wb') as out:
-            for rowIdx in seqData.index:
-                row = seqData.loc[rowIdx]
+            offset = 0
+            records = (pair for chunk in iterRecords(seqData) for pair in zip(chunk['fastaPath'], chunk['strain']))
+            for fastaPath, strain in records:
                 try:
-                    with open(row['fastaPath'],"rb") as f:
-                        if stripMetadata:
-                            header = f.readline()
-                            header = row['strain']
-                            out.write(str.encode(">" + header + "\n"))
-                        shutil.copyfileobj(f, out)
+                    with open(fastaPath,"rb") as f:
+                        data = f.read()
                 except FileNotFoundError:
-                    pass
-                bar()
+                    bar()
+                    continue
+                for (name, header, seq) in it.formatFASTA(data, header = strain if stripMetadata else None):
+                    record = header + b"\n" + b"".join(line + b"\n" for line in seq)
+                    out.write(record)
+                    width = len(seq[0]) if len(seq) else 0
+                    fai.append((name, sum(len(line) for line in seq), offset + len(header) + 1, width, width + 1))
+                    offset += len(record)
+                bar(nbytes = len(data))
+
+    if index: it.writeFAI(outFile + ".fai", fai)
+
+def writeMetadata(outFile: str, mdata: pd.DataFrame | str, keyCol: str = "strain", index = True, chunksize: int = 10000) -> None:
+    """Writes the metadata to a TSV, optionally with an index of the byte offset of each row
+    :param outFile: The path to the output file. Will overwrite or be created if it doesn't exist.
+    :param mdata: The metadata, as a DataFrame or the path to a Parquet file of it (ie. from externalSortRecords)
+    :param keyCol: The column to index rows by, defaults to 'strain'
+    :param index: Also write an index of each key's row to outFile + '.idx'?, defaults to True
+    :param chunksize: The number of rows to format at once, defaults to 10000
+    :return: Nothing
+    """
+    idx = []
+    with open(outFile, 'wb') as out:
+        for i, chunk in enumerate(iterRecords(mdata, chunksize)):
+            if i == 0:
+                index = index and keyCol in chunk.columns
+                out.write(chunk.head(0).to_csv(sep="\t", index=False, lineterminator="\n").encode())
+            if not len(chunk): continue
+            rows = chunk.to_csv(sep="\t", index=False, header=False, lineterminator="\n").encode()
+            if index:
+                lines = rows.splitlines(keepends=True)
+                if len(lines) != len(chunk):
+                    print(f"Metadata contains line breaks within values. Not indexing {outFile}.")
+                    index = False
+                else:
+                    offset = out.tell()
+                    for key, line in zip(chunk[keyCol], lines):
+                        idx.append((key, offset, len(line)))
+                        offset += len(line)
+            out.write(rows)
+
+    if index:
+        with open(outFile + ".idx", 'w') as f:
+            f.write(f"{keyCol}\toffset\tlength\n")
+            for (key, offset, length) in idx: f.write(f"{key}\t{offset}\t{length}\n")
 
 def renameAndSubsetDF(df:pd.DataFrame, cols: dict):
     """Renames columns in a DataFrame and discards columns not in the list
@@ -160,42 +329,168 @@ def convertDecimalDates(df: pd.DataFrame):
         df[col] = df[col].apply(lambda x: year_fraction(x))
     return df
 
-def convertDates(df: pd.DataFrame):
+def convertDates(df: pd.DataFrame, dtypes: dict = None):
     dateCols = [col for col in df.columns if 'date' in col.lower()]
+    dtypes = dtypes or {}
     for col in dateCols:
         df[col] = pd.to_datetime(df[col],errors='coerce',dayfirst=False).dt.strftime('%Y-%m-%d')
+        df[col] = df[col].astype(dtypes.get(col, DEFAULT_DTYPE))
     return df
 
-def generateCOVIDdatabase(seqDataPath:str, patientDataDir: str, dbPath: str, captureCols: dict, output:str, verbose: bool = True):
+def sortRecords(df: pd.DataFrame, sortBy: list[str] = ["date", "strain"]):
+    """Sorts records into a stable order so unchanged records stay in place between builds. Missing values are last.
+    :param df: The DataFrame to sort
+    :param sortBy: The columns to sort by, in order. Columns not in df are skipped. Defaults to date, then strain
+    :return: The sorted DataFrame
+    """
+    sortBy = [col for col in sortBy if col in df.columns]
+    if not len(sortBy): return df
+    # Categories sort in the order they were found, so sort by their values instead
+    key = lambda col: col.astype(str).where(col.notna()) if isinstance(col.dtype, pd.CategoricalDtype) else col
+    return df.sort_values(sortBy, kind='mergesort', na_position='last', key=key).reset_index(drop=True)
+
+def externalSortRecords(df: pd.DataFrame, outFile: str, sortBy: list[str] = ["date", "strain"], maxRows: int = 1000000, chunksize: int = 10000):
+    """Sorts records like sortRecords, without sorting them all in memory at once. Sorted runs of up to maxRows rows are 
+    written to temporary Parquet files next to outFile, then merged by their sort columns into outFile.
+    :param df: The DataFrame to sort. It can be freed once this returns.
+    :param outFile: The path to the sorted Parquet file
+    :param sortBy: The columns to sort by, in order. Columns not in df are skipped. Defaults to date, then strain
+    :param maxRows: The number of rows to sort in memory at once, defaults to 1000000
+    :param chunksize: The number of rows to merge at once, defaults to 10000
+    :return: The path to the sorted Parquet file. Read it with iterRecords.
+    """
+    import heapq, tempfile, pyarrow as pa, pyarrow.parquet as pq
+    from collections import Counter
+    sortBy = [col for col in sortBy if col in df.columns]
+    dtypes = df.dtypes.to_dict()
+
+    def keys(run):
+        # The sort key of each row in a run, in the same order as sortRecords. Missing values are last.
+        with pq.ParquetFile(run) as f:
+            for batch in f.iter_batches(batch_size = chunksize, columns = sortBy):
+                batch = batch.to_pandas()
+                cols = [(batch[col].astype(str) if isinstance(batch[col].dtype, pd.CategoricalDtype) else batch[col]).tolist() for col in sortBy]
+                masks = [batch[col].isna().tolist() for col in sortBy]
+                for i in range(len(batch)):
+                    yield tuple((1, 0) if mask[i] else (0, col[i]) for col, mask in zip(cols, masks))
+
+    with tempfile.TemporaryDirectory(dir = os.path.dirname(os.path.abspath(outFile))) as tmpDir:
+        runs = []
+        for start in range(0, len(df), maxRows):
+            runs.append(os.path.join(tmpDir, f"run{len(runs)}.parquet"))
+            sortRecords(df.iloc[start:start + maxRows], sortBy).to_parquet(runs[-1], index = False, row_group_size = chunksize)
+        if not len(runs):
+            df.head(0).to_parquet(outFile, index = False)
+            return outFile
+
+        # Merge the sort keys, pulling the rows from each run's reader in chunks. Ties keep the order of the runs, so the 
+        # result is the same as a stable sort of the whole DataFrame.
+        order = heapq.merge(*[zip(keys(path), itertools.repeat(run)) for run, path in enumerate(runs)])
+        readers = [iterRecords(path, chunksize) for path in runs]
+        buffers = [next(reader) for reader in readers]
+        schema = pa.unify_schemas([pq.read_schema(path) for path in runs])
+        with pq.ParquetWriter(outFile + ".tmp", schema) as writer:
+            while True:
+                picks = [run for (_, run) in itertools.islice(order, chunksize)]
+                if not len(picks): break
+                counts = Counter(picks)
+                counts = [counts[run] for run in range(len(runs))]
+                pieces = []
+                for run, count in enumerate(counts):
+                    while len(buffers[run]) < count: buffers[run] = concatCompact([buffers[run], next(readers[run])])
+                    pieces.append(buffers[run].iloc[:count])
+                    buffers[run] = buffers[run].iloc[count:]
+                offsets = list(itertools.accumulate(counts, initial = 0))
+                positions = []
+                for run in picks:
+                    positions.append(offsets[run])
+                    offsets[run] += 1
+                chunk = concatCompact(pieces).iloc[positions].astype(dtypes)
+                writer.write_table(pa.Table.from_pandas(chunk, schema = schema, preserve_index = False))
+        for reader in readers: reader.close()
+        os.replace(outFile + ".tmp", outFile)
+    return outFile
+
+def iterRecords(records, chunksize: int = 10000):
+    """Yields records in chunks
+    :param records: A DataFrame, or the path to a Parquet file of records (ie. from externalSortRecords)
+    :param chunksize: The number of rows in each chunk, defaults to 10000
+    :return: A generator of DataFrames. At least one is yielded, so the columns are known even with no records.
+    """
+    if isinstance(records, pd.DataFrame):
+        for start in range(0, max(len(records), 1), chunksize): yield records.iloc[start:start + chunksize]
+        return
+    import pyarrow.parquet as pq
+    with pq.ParquetFile(records) as f:
+        empty = True
+        for batch in f.iter_batches(batch_size = chunksize):
+            empty = False
+            yield batch.to_pandas()
+        if empty: yield f.schema_arrow.empty_table().to_pandas()
+
+def countRecords(records):
+    """Counts records
+    :param records: A DataFrame, or the path to a Parquet file of records (ie. from externalSortRecords)
+    :return: The number of records
+    """
+    if isinstance(records, pd.DataFrame): return len(records)
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(records).metadata.num_rows
+
+def generateCOVIDdatabase(seqDataPath:str, patientDataDir: str, dbPath: str, captureCols: dict, output:str, captureDtypes: dict = None, rowFilter: dict = None, pathMap: dict = None, sortBy: list[str] = ["date", "strain"], sortMaxRows: int = 1000000, cacheDir: str = None, verbose: bool = True):
     """Generates a collated COVID database. Includes all sequencing data, as well as metadata for patient age, gender and region.
     :param seqDataPath: Path to the BioNumerics Export file
     :param patientDataDir: Path to the customer tab data
     :param output: The output CSV
+    :param captureDtypes: dtypes of the captured columns by output name (ie. {"region": "category"}), defaults to DEFAULT_DTYPE
+    :param rowFilter: Conditions rows must pass to be included (ie. {"date": {"months": 6}}). See filterRows.
+    :param pathMap: Path prefixes to replace in the paths read from the flat file database, for using a database made on another host
+    :param sortBy: Columns to sort the output by, so builds are ordered the same each time. Defaults to date, then strain
+    :param sortMaxRows: Builds with more records than this are sorted on disk with externalSortRecords, defaults to 1000000
+    :param cacheDir: Folder to cache converted .xlsx files in, defaults to None (no caching)
     """    
     seqData = getSeqData(seqDataPath = seqDataPath,    
                          dbPath = dbPath, 
                          cols = captureCols,                
+                         dtypes = captureDtypes,
+                         rowFilter = rowFilter,
+                         pathMap = pathMap,
+                         cacheDir = cacheDir,
                          verbose = verbose)
 
     patientData = getPatientMetadata(patientDataDir = patientDataDir,
                                      cols = captureCols, 
+                                     dtypes = captureDtypes,
+                                     rowFilter = rowFilter,
+                                     cacheDir = cacheDir,
                                      verbose = verbose)
 
     Path(output).mkdir(parents=True, exist_ok=True)
     mdataOut = os.path.join(output,"metadata.tsv")
     mdata = collateCOVIDdata(seqData = seqData, patientData = patientData, matchCol = "accession")
-    mdata = convertDates(mdata)
+    mdata, fastaCounts = validateFASTApaths(mdata, verbose = verbose)
+    mdata = convertDates(mdata, captureDtypes)
+    nRecords = len(mdata)
+    if sortMaxRows is not None and nRecords > sortMaxRows:
+        if verbose: print(f"\nSorting {nRecords} records on disk...")
+        mdata = externalSortRecords(mdata, os.path.join(output, ".sorted.parquet"), sortBy, maxRows = sortMaxRows)
+    else:
+        mdata = sortRecords(mdata, sortBy)
     print("\nGenerating metadata.tsv...")
-    mdata.to_csv(mdataOut, sep="\t", index=False)
+    writeMetadata(mdataOut, mdata)
     seqsOut = os.path.join(output,"sequences.fasta")
     writeSequences(seqData = mdata, outFile = seqsOut)
+    if isinstance(mdata, str): os.remove(mdata)
 
     print(f"\nAuspice output generated!\n"
           f"-------------------------\n"
           f"Found {len(seqData)} sequences\n"
           f"Found {len(patientData)} patient metadata entries\n"
-          f"Matched {len(mdata)} sequences to metadata\n"
+          f"Matched {fastaCounts['ok'] + fastaCounts['missing'] + fastaCounts['empty']} sequences to metadata\n"
+          f"Dropped {fastaCounts['missing']} sequences with missing FASTA files\n"
+          f"Dropped {fastaCounts['empty']} sequences with empty FASTA files\n"
+          f"Wrote {nRecords} sequences\n"
           f"-------------------------\n"
           f"Saved to:\n"
-          f"Sequences: {seqsOut}\n"
-          f"Metadata: {mdataOut}\n")
\ No newline at end of file
+          f"Sequences: {seqsOut} (index: {seqsOut}.fai)\n"
+          f"Metadata: {mdataOut} (index: {mdataOut}.idx)\n")
\ No newline at end of file
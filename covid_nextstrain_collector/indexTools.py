@@ -0,0 +1,99 @@
+import pandas as pd, os, io, mmap
+
+def formatFASTA(data: bytes, header: str = None):
+    """Normalizes a FASTA file so it can be indexed. Line endings are converted to '\\n', blank lines are removed, and
+    records with uneven line lengths are re-wrapped to the length of their first line.
+    :param data: The contents of the FASTA file
+    :param header: Replaces the first line of the file if given (ie. the strain name)
+    :return: A list of (name, header line, sequence lines) for each record, where name is the header up to the first whitespace
+    """
+    lines = data.splitlines()
+    if header is not None: lines[:1] = [b">" + header.encode()]
+    records = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith(b">"):
+            records.append([line, []])
+        elif len(line):
+            if not len(records): records.append([b">", []])
+            records[-1][1].append(line)
+
+    out = []
+    for (head, seq) in records:
+        width = len(seq[0]) if len(seq) else 0
+        if any(len(line) != width for line in seq[:-1]) or (len(seq) and len(seq[-1]) > width):
+            seq = b"".join(seq)
+            seq = [seq[i:i+width] for i in range(0, len(seq), width)]
+        name = head[1:].split()[0].decode() if len(head) > 1 else ""
+        out.append((name, head, seq))
+    return out
+
+def writeFAI(outFile: str, entries: list[tuple]):
+    """Writes a samtools-compatible FASTA index
+    :param outFile: The path to the .fai file
+    :param entries: A list of (name, length, offset, linebases, linewidth) for each record
+    """
+    with open(outFile, 'w') as f:
+        for entry in entries:
+            f.write("\t".join(str(val) for val in entry) + "\n")
+
+def readFAI(faiFile: str):
+    """Reads a FASTA index
+    :param faiFile: The path to the .fai file
+    :return: A dict of name to (length, offset, linebases, linewidth)
+    """
+    index = {}
+    with open(faiFile) as f:
+        for line in f:
+            (name, length, offset, linebases, linewidth) = line.rstrip("\n").split("\t")[:5]
+            index[name] = (int(length), int(offset), int(linebases), int(linewidth))
+    return index
+
+def readMetadataIndex(idxFile: str):
+    """Reads a metadata index written by writeMetadata
+    :param idxFile: The path to the .idx file
+    :return: A dict of key to (offset, length)
+    """
+    index = {}
+    with open(idxFile) as f:
+        next(f, None)
+        for line in f:
+            (key, offset, length) = line.rstrip("\n").split("\t")
+            index[key] = (int(offset), int(length))
+    return index
+
+def fetchSequences(fastaFile: str, names: list[str], index = None):
+    """Fetches sequences from an indexed FASTA file without reading the whole file
+    :param fastaFile: The path to the FASTA file
+    :param names: The names (ie. strains) to fetch
+    :param index: The index from readFAI, or the path to the .fai file. Defaults to fastaFile + '.fai'
+    :return: A dict of name to sequence. Names not in the index are skipped.
+    """
+    if isinstance(names, str): names = [names]
+    if not isinstance(index, dict): index = readFAI(index or fastaFile + ".fai")
+    out = {}
+    if os.path.getsize(fastaFile) == 0: return out
+    with open(fastaFile, "rb") as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+        for name in names:
+            if name not in index: continue
+            (length, offset, linebases, linewidth) = index[name]
+            end = offset + (length // linebases) * linewidth + length % linebases if linebases else offset
+            out[name] = mm[offset:end].replace(b"\n", b"").replace(b"\r", b"").decode()
+    return out
+
+def fetchMetadata(metadataFile: str, keys: list[str], index = None, **kargs):
+    """Fetches rows from an indexed metadata file without reading the whole file
+    :param metadataFile: The path to the metadata file
+    :param keys: The keys (ie. strains) to fetch
+    :param index: The index from readMetadataIndex, or the path to the .idx file. Defaults to metadataFile + '.idx'
+    :param **kargs: Additional arguments to pd.read_csv
+    :return: A DataFrame of the found rows, in the order of keys
+    """
+    if isinstance(keys, str): keys = [keys]
+    if not isinstance(index, dict): index = readMetadataIndex(index or metadataFile + ".idx")
+    with open(metadataFile, "rb") as f:
+        header = f.readline()
+        if not any(key in index for key in keys): return pd.read_csv(io.BytesIO(header), sep="\t", **kargs)
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            rows = [mm[index[key][0]:index[key][0] + index[key][1]] for key in keys if key in index]
+    return pd.read_csv(io.BytesIO(header + b"".join(rows)), sep="\t", **kargs)
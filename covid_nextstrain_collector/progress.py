@@ -0,0 +1,86 @@
+import sys, time
+from alive_progress import alive_bar
+
+class ProgressBar:
+    """Progress bar that batches updates to alive_bar and tracks throughput.
+    Items are counted on every call, but the bar is only redrawn every `every` items or `interval` seconds.
+    """
+    def __init__(self, total: int = None, title: str = None, every: int = 1000, interval: float = 0.1, **kargs):
+        """
+        :param total: The total number of items, if known
+        :param title: The title of the bar
+        :param every: Update the bar after this many items, defaults to 1000
+        :param interval: Update the bar after this many seconds, defaults to 0.1
+        :param **kargs: Additional arguments to alive_bar
+        """
+        self.total = total
+        self.title = title
+        self.every = every
+        self.interval = interval
+        self.kargs = kargs
+        self.items = 0
+        self.bytes = 0
+        self._pending = 0
+        self._bar = None
+
+    def __enter__(self):
+        self._alive = alive_bar(total = self.total, title = self.title, unknown = "dots_waves", **self.kargs)
+        self._bar = self._alive.__enter__()
+        self._start = self._last = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        return self._alive.__exit__(*exc)
+
+    def __call__(self, n: int = 1, nbytes: int = 0):
+        """Counts processed items
+        :param n: The number of items processed, defaults to 1
+        :param nbytes: The number of bytes processed, defaults to 0
+        """
+        self.items += n
+        self.bytes += nbytes
+        self._pending += n
+        if self._pending >= self.every or time.monotonic() - self._last >= self.interval: self.flush()
+
+    def flush(self):
+        """Pushes the pending count and the current throughput to the bar"""
+        self._last = time.monotonic()
+        if self._pending: self._bar(self._pending)
+        self._pending = 0
+        if self.bytes: self._bar.text = f"{self.bytesPerSec / 1024**2:.1f} MB/s"
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+    @property
+    def itemsPerSec(self):
+        return self.items / max(self.elapsed, 1e-9)
+
+    @property
+    def bytesPerSec(self):
+        return self.bytes / max(self.elapsed, 1e-9)
+
+class NullProgressBar:
+    """A progress bar that does nothing, for quiet and non-interactive runs"""
+    items = bytes = elapsed = itemsPerSec = bytesPerSec = 0
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def __call__(self, n: int = 1, nbytes: int = 0): pass
+    def flush(self): pass
+
+def progressBar(total: int = None, title: str = None, every: int = 1000, interval: float = 0.1, verbose = True, force = False, **kargs):
+    """Creates a batched progress bar. Use as `with progressBar(...) as bar: bar()`.
+    :param total: The total number of items, if known
+    :param title: The title of the bar
+    :param every: Update the bar after this many items, defaults to 1000
+    :param interval: Update the bar after this many seconds, defaults to 0.1
+    :param verbose: Show the bar?, defaults to True
+    :param force: Show the bar even if not in an interactive terminal (ie. cron), defaults to False
+    :param **kargs: Additional arguments to alive_bar
+    :return: A ProgressBar, or a NullProgressBar if not shown
+    """
+    verbose = verbose and (force or sys.stdout.isatty())
+    return ProgressBar(total = total, title = title, every = every, interval = interval, **kargs) if verbose else NullProgressBar()
@@ -1,9 +1,10 @@
 from ast import Pass
 import pandas as pd, os, re, time, ahocorasick, pickle, numpy as np, glob, random, itertools, copy, shutil, logging, errno
 from pathlib import Path
-from contextlib import suppress
-from alive_progress import alive_bar
+from contextlib import suppress, nullcontext
+from covid_nextstrain_collector.progress import progressBar
 from itertools import chain
+import functools
 
 def findFile(regex):
     """Simple finder for a single file
@@ -12,22 +13,115 @@ def findFile(regex):
     return(glob.glob(regex, recursive = True))
 
 def generateMLookupDB(dir: str, outDir: str, excludeDirs: list[str] = None):
-    """ Generates a mlocate.db database for indexed searching
+    """ Generates a trigram index of a directory for indexed searching. Replaces the mlocate.db from `updatedb`.
     :param dir: The directory to search
     :param outDir: the file to save database to
     :param excludeDirs: Directories to omit
-    """       
-    updatedb = "updatedb --database-root '" + dir + "' --output '" + outDir + "'"
-    if excludeDirs != None: updatedb = updatedb + ' --prunepaths "' + " ".join(excludeDirs) + '"'
-    os.system(updatedb)
+    :return: The path to the index
+    """
+    if not os.path.exists(dir): raise Exception("Directory '" + dir + "' does not exist. Cannot generate database.")
+    prune = {os.path.abspath(d) for d in (excludeDirs or [])}
+    paths = []
+    for root, dirs, files in os.walk(dir):
+        # Prune excluded directories so they are never crawled, as with `updatedb --prunepaths`
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) not in prune]
+        paths.extend(os.path.join(root, item) for item in files + dirs)
+    return generateTrigramIndex(paths, outFile = outDir)
 
 def mlocateFile(file, mLocateDB):
-    import subprocess
-    command = "locate --database '" + mLocateDB + "' --nofollow '" + file + "'"
-    try:
-        return(subprocess.check_output(command, shell=True, text=True))
-    except subprocess.CalledProcessError:
-        return(None)   
+    """Finds all paths containing a string. Replaces `locate`. 
+    An index loaded from a path is cached, but for many lookups prefer a single batch call to searchTrigramIndex.
+    :param file: The string to search for
+    :param mLocateDB: The index generated by generateMLookupDB, either loaded with loadTrigramIndex or its path
+    :return: The matching paths, one per line, or None if nothing matched
+    """
+    matches = searchTrigramIndex(mLocateDB, [file], caseSensitive = True)[file]
+    return("\n".join(matches) + "\n" if len(matches) else None)
+
+def generateTrigramIndex(db, outFile: str = None, verbose = True):
+    """Generates a trigram (3 character substring) index of a flat file database for fast substring lookups.
+    The index is case-insensitive, but can answer case-sensitive queries.
+    :param db: The path to the flat file database generated by generateFlatFileDB, or a list of paths
+    :param outFile: An optional output file to pickle into
+    :param verbose: Show progress bar
+    :return: The index or the path to the pickle
+    """
+    if isinstance(db, str): db = open(db)
+    paths = [str(path).strip() for path in db]
+    postings = {}
+
+    with progressBar(total = len(paths), title="Indexing paths...", verbose = verbose) as bar:
+        for idx, path in enumerate(paths):
+            key = path.lower()
+            for gram in {key[i:i+3] for i in range(len(key) - 2)}:
+                postings.setdefault(gram, []).append(idx)
+            bar()
+
+    postings = {gram: np.array(ids, dtype=np.uint32) for gram, ids in postings.items()}
+    index = {"paths": paths, "postings": postings}
+
+    if (outFile is not None):
+        with open(outFile, "wb") as f:
+            pickle.dump(index, f, protocol = pickle.HIGHEST_PROTOCOL)
+        return outFile
+    else:
+        return index
+
+def loadTrigramIndex(index):
+    """Loads a trigram index generated by generateTrigramIndex. Indexes loaded from a path are cached until the file changes.
+    :param index: The index, or the path to the pickled index
+    :return: The index
+    """
+    if isinstance(index, dict): return index
+    stat = os.stat(index)
+    return _loadTrigramIndexFile(os.path.abspath(index), stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize = 4)
+def _loadTrigramIndexFile(path: str, mtime: int, size: int):
+    """Unpickles a trigram index. The modification time and size are only used as part of the cache key."""
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def searchTrigramIndex(index, searchTerms: list[str], caseSensitive = False, maxCandidates: int = 64, pathMap: dict = None):
+    """Finds all paths containing each of the search terms using a trigram index.
+    Posting lists are intersected from rarest to most common until few enough candidates remain, which are then verified.
+    :param index: The index, or the path to the pickled index
+    :param searchTerms: The strings to search for
+    :param caseSensitive: Is case important?, defaults to False
+    :param maxCandidates: Stop intersecting posting lists once this few candidates remain, defaults to 64
+    :param pathMap: Path prefixes to replace in the found paths. See remapPaths.
+    :return: A dict of each search term to a list of matching paths
+    """
+    index = loadTrigramIndex(index)
+    paths, postings = index["paths"], index["postings"]
+    if isinstance(searchTerms, str): searchTerms = [searchTerms]
+
+    out = {}
+    for term in searchTerms:
+        term = str(term)
+        if term in out: continue
+        key = term.lower()
+        if len(key) < 3:
+            candidates = range(len(paths))
+        else:
+            grams = [postings.get(gram) for gram in {key[i:i+3] for i in range(len(key) - 2)}]
+            if any(ids is None for ids in grams):
+                out[term] = []
+                continue
+            grams.sort(key = len)
+            candidates = grams[0]
+            for ids in grams[1:]:
+                if len(candidates) <= maxCandidates: break
+                candidates = np.intersect1d(candidates, ids, assume_unique = True)
+        if caseSensitive:
+            out[term] = [paths[i] for i in candidates if term in paths[i]]
+        else:
+            out[term] = [paths[i] for i in candidates if key in paths[i].lower()]
+
+    if pathMap:
+        trie = generatePathTrie(pathMap)
+        out = {term: remapPaths(found, trie) for term, found in out.items()}
+    return out
 
 def generateFlatFileDB(dir: list[str],  outFile: str = None, overwrite = False, verbose = True):
     """Retrieves all files within a specified folder.
@@ -37,26 +131,141 @@ def generateFlatFileDB(dir: list[str],  outFile: str = None, overwrite = False,
     :param verbose: Show progress bar
     :return: A list of files, or the path to the output DB file
     """
-    # TODO: Parse input dirs and remove any child directories
     paths = [dir] if isinstance(dir, str) else dir
     for path in paths:
         if not os.path.exists(path): raise Exception("Directory '" + path + "' does not exist. Cannot generate database.")
+    paths = dedupeRoots(paths)
     if (overwrite == False and outFile is not None and os.path.exists(outFile)): 
         print("DB already exists and overwrite = False. Retrieving existing DB...")
         return outFile
     out = [] if outFile is None else open(outFile,'w')
 
-    with alive_bar(title="Retrieving files...", unknown="dots_waves", disable = not verbose) as bar: 
+    with progressBar(title="Retrieving files...", verbose = verbose) as bar: 
         for root, dirs, files in chain.from_iterable(os.walk(path) for path in paths):
             for item in files + dirs:           
                 found = os.path.join(root, item)          
                 out.write(found + "\n") if outFile is not None else out.append(found)
-                bar()
+            bar(len(files) + len(dirs))
             
 
     if outFile is not None: out.close()
     return (out if outFile is None else outFile)
 
+def dedupeRoots(dirs: list[str]):
+    """Removes duplicate directories and directories nested in another, so each path is only crawled once
+    :param dirs: The directories
+    :return: The top-level directories, in their original order and form
+    """
+    norm = {dir: os.path.join(os.path.abspath(dir), "") for dir in dirs}
+    roots = []
+    for dir in dirs:
+        nested = any(norm[dir].startswith(norm[other]) and (norm[dir] != norm[other] or other in roots) for other in dirs if other != dir)
+        if not nested and norm[dir] not in (norm[root] for root in roots): roots.append(dir)
+    return roots
+
+def flatFileDBShardPath(dir: str, shardDir: str):
+    """Gets the path of the shard for a directory
+    :param dir: The directory
+    :param shardDir: The folder shards are kept in
+    :return: The path to the shard
+    """
+    import hashlib
+    name = hashlib.sha1(os.path.abspath(dir).encode()).hexdigest()[:16]
+    return os.path.join(shardDir, f"{Path(dir).name or 'root'}.{name}.txt")
+
+def generateFlatFileDBShard(dir: str, outFile: str):
+    """Crawls a single directory into a sorted shard of a flat file database
+    :param dir: The directory to crawl
+    :param outFile: The path to the shard
+    :return: The path to the shard
+    """
+    unsortedFile = outFile + ".unsorted"
+    generateFlatFileDB(dir, outFile = unsortedFile, overwrite = True, verbose = False)
+    externalSort(unsortedFile, outFile + ".tmp")
+    os.remove(unsortedFile)
+    os.replace(outFile + ".tmp", outFile)
+    return outFile
+
+def externalSort(inFile: str, outFile: str, maxLines: int = 1000000, key = None):
+    """Sorts the lines of a file that may be larger than memory. Sorted runs of up to maxLines lines are written to
+    temporary files, then merged.
+    :param inFile: The file to sort
+    :param outFile: The output file path. Can be the same as inFile.
+    :param maxLines: The number of lines to sort in memory at once, defaults to 1000000
+    :param key: A function of a line to sort by, defaults to the line itself
+    :return: The path to the output file
+    """
+    import heapq, tempfile
+    runs = []
+    try:
+        with open(inFile) as f:
+            while True:
+                lines = list(itertools.islice(f, maxLines))
+                if not len(lines): break
+                if not lines[-1].endswith("\n"): lines[-1] += "\n"
+                lines.sort(key = key)
+                run = tempfile.TemporaryFile(mode = "w+")
+                run.writelines(lines)
+                run.seek(0)
+                runs.append(run)
+        with open(outFile, "w") as out:
+            out.writelines(heapq.merge(*runs, key = key))
+    finally:
+        for run in runs: run.close()
+    return outFile
+
+def mergeFlatFileDBShards(shards: list[str], outFile: str):
+    """Merges sorted shards into a single sorted flat file database, dropping duplicate paths
+    :param shards: The paths to the shards
+    :param outFile: The output file path
+    :return: The path to the output DB file
+    """
+    import heapq
+    files = [open(shard) for shard in shards]
+    try:
+        with open(outFile, 'w') as out:
+            last = None
+            for line in heapq.merge(*files):
+                if line != last: out.write(line)
+                last = line
+    finally:
+        for f in files: f.close()
+    return outFile
+
+def generateShardedFlatFileDB(dir: list[str], shardDir: str, outFile: str, refresh: list[str] = [], overwrite = False, processes: int = None, verbose = True):
+    """Crawls directories into a flat file database, one shard per directory. Nested directories are only crawled once.
+    Existing shards are re-used, so a single changed directory can be re-crawled with `refresh` and merged without 
+    re-crawling everything else.
+    :param dir: Directory(ies) to search
+    :param shardDir: The folder to keep shards in
+    :param outFile: The output file path
+    :param refresh: Directory(ies) to re-crawl even if their shard exists
+    :param overwrite: Re-crawl all directories?, defaults to False
+    :param processes: Number of directories to crawl at once, defaults to the number of CPUs
+    :param verbose: Print progress messages?, defaults to True
+    :return: The path to the output DB file
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    paths = [dir] if isinstance(dir, str) else dir
+    for path in paths:
+        if not os.path.exists(path): raise Exception("Directory '" + path + "' does not exist. Cannot generate database.")
+    paths = dedupeRoots(paths)
+    refresh = {os.path.abspath(path) for path in ([refresh] if isinstance(refresh, str) else refresh)}
+    Path(shardDir).mkdir(parents = True, exist_ok = True)
+
+    shards = [flatFileDBShardPath(path, shardDir) for path in paths]
+    crawl = [(path, shard) for path, shard in zip(paths, shards) 
+             if overwrite or not os.path.exists(shard) or os.path.abspath(path) in refresh]
+
+    if len(crawl):
+        if verbose: print(f"Crawling {len(crawl)} of {len(paths)} directories...")
+        with ProcessPoolExecutor(max_workers = processes) as executor:
+            list(executor.map(generateFlatFileDBShard, *zip(*crawl)))
+
+    if verbose: print(f"Merging {len(shards)} shards...")
+    return mergeFlatFileDBShards(shards, outFile)
+
 # printFound = lambda nFiles, nFound, speed, end="\r": print("   Parsed {} files and found {} files ({}s)                 ".format(nFiles,nFound,speed),end=end)
 # def generateFlatFileDB(dir: str, regex: str = None, fileExt: str = None, outFile: str = None, overwrite = False, maxFiles:int = 100000000, excludeDirs: list[str] = [], verbose: bool = True):
 #     """Finds all files that fit a regex in a specified folder
@@ -108,7 +317,91 @@ def generateFlatFileDB(dir: list[str],  outFile: str = None, overwrite = False,
 #     if (verbose): printFound(nFiles,nFound,str(round(time.time() - startTime,2)),"\n")
 #     return (out if outFile is None else outFile)
 
-def searchFlatFileDB(db: str = None, outFile: str = None, searchTerms: list[str] = [], includeTerms: list[str] = [], excludeTerms: list[str] = [], caseSensitive = False, verbose = True):
+# Automatons and DB for the parallel scan. Set before forking so workers inherit them instead of unpickling copies.
+_scanState = {}
+
+def chunkFlatFileDB(db: str, nChunks: int):
+    """Splits a flat file database into byte ranges that are aligned to line boundaries
+    :param db: The path to the flat file database
+    :param nChunks: The number of chunks to split into
+    :return: A list of (start, end) byte offsets
+    """
+    size = os.path.getsize(db)
+    bounds = [0]
+    with open(db, "rb") as f:
+        for i in range(1, nChunks):
+            f.seek(max(size * i // nChunks, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+def _matchFlatFileDBLine(file: str):
+    """Checks a single path against the search, include and exclude automatons in _scanState"""
+    key = file if _scanState["caseSensitive"] else file.lower()
+    f = f"^{key}$"
+    if not all(next(automaton.iter(f), False) for automaton in _scanState["searchAutomatons"]): return False
+    if _scanState["includeAutomaton"] is not None and not next(_scanState["includeAutomaton"].iter(f), False): return False
+    if _scanState["excludeAutomaton"] is not None and next(_scanState["excludeAutomaton"].iter(key), False): return False
+    return True
+
+def _scanFlatFileDBChunk(chunk: tuple[int, int]):
+    """Scans a chunk of the DB in _scanState. Chunks are byte ranges for a DB file or index ranges for a list."""
+    (start, end) = chunk
+    db = _scanState["db"]
+    if isinstance(db, str):
+        with open(db, "rb") as f:
+            f.seek(start)
+            lines = f.read(end - start).decode(errors = "surrogateescape").splitlines()
+    else:
+        lines = db[start:end]
+    lines = (str(line).strip() for line in lines)
+    return [line for line in lines if line and _matchFlatFileDBLine(line)]
+
+def scanFlatFileDBParallel(db, searchTerms: list[str] = [], includeTerms: list[str] = [], excludeTerms: list[str] = [], caseSensitive = False, processes: int = None, verbose = True):
+    """Searches a flat file database in parallel. The DB is split into chunks, each scanned by a worker process
+    with automatons built once and inherited by fork. Falls back to a single process where fork is unavailable.
+    :param db: The path to the flat file database generated by generateFlatFileDB, or a list of paths
+    :param searchTerms: Strings that paths must include
+    :param includeTerms: Strings that paths must include at least one of 
+    :param excludeTerms: Strings that paths must not include
+    :param caseSensitive: Is case important?, defaults to False
+    :param processes: The number of worker processes, defaults to the number of CPUs
+    :param verbose: Print progress messages?, defaults to True
+    :return: A list of the matching paths, in DB order
+    """
+    import multiprocessing
+
+    processes = processes or os.cpu_count() or 1
+    if "fork" not in multiprocessing.get_all_start_methods(): processes = 1
+
+    if not isinstance(db, str): db = list(db)
+    nChunks = processes * 4
+    if isinstance(db, str):
+        chunks = chunkFlatFileDB(db, nChunks)
+    else:
+        step = -(-len(db) // nChunks) or 1
+        chunks = [(start, start + step) for start in range(0, len(db), step)]
+
+    _scanState.update(db = db, caseSensitive = caseSensitive,
+                      searchAutomatons = [generateSearchAutomaton(term, caseSensitive = caseSensitive) for term in searchTerms],
+                      includeAutomaton = generateSearchAutomaton(includeTerms, caseSensitive = caseSensitive) if len(includeTerms) else None,
+                      excludeAutomaton = generateSearchAutomaton(excludeTerms, caseSensitive = caseSensitive) if len(excludeTerms) else None)
+    out = []
+    try:
+        # Fork the workers before the progress bar starts its refresh thread. Exiting the pool terminates any left behind.
+        with (multiprocessing.get_context("fork").Pool(processes) if processes > 1 else nullcontext()) as pool:
+            results = pool.imap(_scanFlatFileDBChunk, chunks) if processes > 1 else map(_scanFlatFileDBChunk, chunks)
+            with progressBar(total = len(chunks), title="Scanning DB chunks...", every = 1, verbose = verbose) as bar:
+                for (start, end), result in zip(chunks, results):
+                    out.extend(result)
+                    bar(nbytes = end - start if isinstance(db, str) else 0)
+    finally:
+        _scanState.clear()
+
+    return list(dict.fromkeys(out))
+
+def searchFlatFileDB(db: str = None, outFile: str = None, searchTerms: list[str] = [], includeTerms: list[str] = [], excludeTerms: list[str] = [], caseSensitive = False, processes: int = 1, pathMap: dict = None, verbose = True):
     """Searches a flat file database. 
     :param db: The path to the flat file database generated by generateFlatFileDB
     :param outFile: The path to save the subset database in, will output list otherwise
@@ -116,13 +409,19 @@ def searchFlatFileDB(db: str = None, outFile: str = None, searchTerms: list[str]
     :param includeTerms: Strings that paths must include at least one of 
     :param excludeTerms: Strings that paths must not include
     :param caseSensitive: Is case important?, defaults to False
+    :param processes: Number of processes to scan with. If not 1, see scanFlatFileDBParallel. None uses all CPUs. Defaults to 1
+    :param pathMap: Path prefixes to replace in the found paths (ie. {"/mnt/data/": "Z:\\data\\"}). See remapPaths.
     :param verbose: Print progress messages?, defaults to True
     """
-    #TODO: Remove the error/exclamation marks from the progress bars
     searchTerms = [searchTerms] if isinstance(searchTerms, str) else searchTerms
     includeTerms = [includeTerms] if isinstance(includeTerms, str) else includeTerms
     excludeTerms = [excludeTerms] if isinstance(excludeTerms, str) else excludeTerms
 
+    if processes != 1:
+        db = scanFlatFileDBParallel(db, searchTerms = searchTerms, includeTerms = includeTerms, excludeTerms = excludeTerms, 
+                                    caseSensitive = caseSensitive, processes = processes, verbose = verbose)
+        return writeFlatFileDB(remapPaths(db, pathMap), outFile)
+
     if isinstance(db, str): db = set(open(db))
 
     db = {str(file).strip() for file in db}
@@ -131,40 +430,42 @@ def searchFlatFileDB(db: str = None, outFile: str = None, searchTerms: list[str]
     if (len(searchTerms)):
         automatons = [generateSearchAutomaton(term, caseSensitive = caseSensitive) for term in searchTerms]
         out = set()
-        with alive_bar(total = len(db), title="Checking for search terms....", unknown="dots_waves", disable = not verbose) as bar:
+        with progressBar(total = len(db), title="Checking for search terms....", verbose = verbose) as bar:
             for file in set(db):
                 f = f"^{file}$"
                 add = [next(automaton.iter(f if caseSensitive else f.lower()),False) for automaton in automatons]         
-                if all(add): 
-                    out.add(file)
-                    bar()
+                if all(add): out.add(file)
+                bar()
         db = copy.deepcopy(out)
 
     # Keep by includeAutomaton
     if (len(includeTerms)):
         includeAutomaton = generateSearchAutomaton(includeTerms, caseSensitive = caseSensitive)
         out = set()
-        with alive_bar(total = len(db), title="Checking for include terms...", unknown="dots_waves", disable = not verbose) as bar:
+        with progressBar(total = len(db), title="Checking for include terms...", verbose = verbose) as bar:
             for file in set(db):
                 f = f"^{file}$"
-                if (next(includeAutomaton.iter(f if caseSensitive else f.lower()),False)): 
-                    out.add(file)
-                    bar()
+                if (next(includeAutomaton.iter(f if caseSensitive else f.lower()),False)): out.add(file)
+                bar()
         db = copy.deepcopy(out)
 
     # Remove by excludeTerms
     if (len(excludeTerms)):
         excludeAutomaton = generateSearchAutomaton(excludeTerms, caseSensitive = caseSensitive)
         out = copy.deepcopy(db)
-        with alive_bar(total = len(db), title="Checking for exclude terms...", unknown="dots_waves", disable = not verbose) as bar:
+        with progressBar(total = len(db), title="Checking for exclude terms...", verbose = verbose) as bar:
             for file in set(out):             
-                if (next(excludeAutomaton.iter(file if caseSensitive else file.lower()),False)): 
-                    db.discard(file)
-                else:
-                    bar()
+                if (next(excludeAutomaton.iter(file if caseSensitive else file.lower()),False)): db.discard(file)
+                bar()
 
-    db = list(db)
+    return writeFlatFileDB(remapPaths(list(db), pathMap), outFile)
 
+def writeFlatFileDB(db: list[str], outFile: str = None):
+    """Saves a list of paths as a flat file database
+    :param db: The list of paths
+    :param outFile: The path to save the database in. If None, nothing is saved.
+    :return: The list, or the path to the output DB file
+    """
     if (outFile is not None):
         with open(outFile, 'w') as f:
             for line in db:
@@ -572,6 +873,57 @@ def str_extract(pattern, input, trim = True):
         return None
     return matches
              
+def _regexChunk(regex, values: list, extract: bool):
+    """Searches a chunk of values with a compiled regex. Non-strings do not match."""
+    search = regex.search
+    if extract:
+        return [(match.group(0) if (match := search(val)) else None) if isinstance(val, str) else None for val in values]
+    return [val if isinstance(val, str) and search(val) else None for val in values]
+
+def _regexBatch(pattern, input, extract: bool, trim: bool, flags: int, processes: int, chunksize: int):
+    """Shared implementation of str_search_batch and str_extract_batch"""
+    import multiprocessing
+
+    regex = pattern if isinstance(pattern, re.Pattern) else re.compile(pattern, flags)
+    if isinstance(input, pd.Series):
+        matches = pd.Series(_regexBatch(regex, input.astype(object).tolist(), extract, False, flags, processes, chunksize), index = input.index, dtype = object)
+        return matches.dropna() if trim else matches
+
+    values = list(input)
+    if processes == 1 or "fork" not in multiprocessing.get_all_start_methods() or len(values) <= chunksize:
+        matches = _regexChunk(regex, values, extract)
+    else:
+        chunks = [(regex, values[i:i + chunksize], extract) for i in range(0, len(values), chunksize)]
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            matches = list(chain.from_iterable(pool.starmap(_regexChunk, chunks)))
+
+    if trim: matches = [match for match in matches if match is not None]
+    return np.array(matches, dtype = object) if isinstance(input, np.ndarray) else matches
+
+def str_search_batch(pattern, input, trim: bool = True, flags: int = 0, processes: int = 1, chunksize: int = 100000):
+    """Batch version of str_search. The pattern is compiled once for all strings.
+    :param pattern: Regular expression (or compiled pattern) to search with
+    :param input: The strings to search, as a list, NumPy array or pandas Series. Non-strings do not match.
+    :param trim: Remove the None values, defaults to True
+    :param flags: Flags to compile the pattern with, defaults to 0
+    :param processes: Number of processes to search with. None uses all CPUs. Defaults to 1
+    :param chunksize: The number of strings per process, defaults to 100000
+    :return: The strings that matched the pattern, in the same type as the input. Series keep their index.
+    """
+    return _regexBatch(pattern, input, extract = False, trim = trim, flags = flags, processes = processes, chunksize = chunksize)
+
+def str_extract_batch(pattern, input, trim: bool = True, flags: int = 0, processes: int = 1, chunksize: int = 100000):
+    """Batch version of str_extract. The pattern is compiled once for all strings.
+    :param pattern: Regular expression (or compiled pattern) to search with
+    :param input: The strings to search, as a list, NumPy array or pandas Series. Non-strings do not match.
+    :param trim: Remove the None values, defaults to True
+    :param flags: Flags to compile the pattern with, defaults to 0
+    :param processes: Number of processes to search with. None uses all CPUs. Defaults to 1
+    :param chunksize: The number of strings per process, defaults to 100000
+    :return: The first match in each string, in the same type as the input. Series keep their index.
+    """
+    return _regexBatch(pattern, input, extract = True, trim = trim, flags = flags, processes = processes, chunksize = chunksize)
+
 def parseExtensions(dir: str, maxFiles = 100000): 
     """Gets all extensions from a target directory
     :param targetDir: The path to the target directory
@@ -618,27 +970,68 @@ def suctionBash(dir:list[str], excludeDirs: list[str]):
 
     os.system("bash -c '%s'" % script)
 
-def suction(dir:list[str], excludeDirs: list[str] = []):
-    """Moves all files within the specified directory to the root dir, then deletes all the folders
+def uniqueFileName(file: str, taken: set[str]):
+    """Finds a file name that is not already taken, adding a numeric suffix (ie. 'name.1.ext') if needed
+    :param file: The desired file name
+    :param taken: The names already in use. The returned name is added to this set.
+    :return: A collision-free file name
+    """
+    filename = file
+    (name,ext) = os.path.splitext(file)
+    idx = 1
+    while filename in taken:
+        filename = name + f".{idx}" + ext
+        idx += 1
+    taken.add(filename)
+    return filename
+
+def moveFile(src: str, dest: str):
+    """Moves a file with a single rename, falling back to a copy if the destination is on another device
+    :param src: The file to move
+    :param dest: The full destination path
+    """
+    try:
+        os.rename(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV: raise
+        shutil.move(src, dest)
+
+def suction(dir:list[str], excludeDirs: list[str] = [], threads: int = 16, verbose = True):
+    """Moves all files within the specified directory to the root dir, then deletes all the folders.
+    Duplicate file names are renamed with a numeric suffix (ie. 'name.1.ext').
     :param dir: The directory to suction
     :param excludeDirs: A list of directories to ignore
-    """    
-    import shutil
+    :param threads: The number of concurrent moves, defaults to 16
+    :param verbose: Print progress messages?, defaults to True
+    :return: A dict mapping the old path of each moved file to its new path
+    """
+    from concurrent.futures import ThreadPoolExecutor
 
+    # Index the destination names once instead of checking the disk for every file
+    taken = set(os.listdir(dir))
+    moves = {}
+    subDirs = []
     for root, dirs, files in os.walk(dir, topdown=True, followlinks=False):
         dirs[:] = [d for d in dirs if d not in excludeDirs]
         if (root == dir): continue
+        subDirs.append(root)
         for file in files:
-            filename = file
-            idx = 1
-            while (os.path.exists(os.path.join(dir, filename))):
-                print(f"Duplicate file found for {file}")
-                (name,ext) = os.path.splitext(file)
-                filename = name + f".{idx}" + ext
-            os.rename(os.path.join(root, file), os.path.join(root, filename))            
-            shutil.move(os.path.join(root, filename), dir)
+            filename = uniqueFileName(file, taken)
+            if verbose and filename != file: print(f"Duplicate file found for {file}. Renaming to {filename}")
+            moves[os.path.join(root, file)] = os.path.join(dir, filename)
+
+    if verbose: print(f"Moving {len(moves)} files...")
+    with ThreadPoolExecutor(max_workers = threads) as executor:
+        list(executor.map(moveFile, moves.keys(), moves.values()))
 
-    [shutil.rmtree(os.path.join(dir,d)) for d in next(os.walk(dir))[1]]
+    # Delete the emptied folders, deepest first. Excluded folders (and their parents) are kept.
+    for root in sorted(subDirs, key=len, reverse=True):
+        for item in os.listdir(root):
+            path = os.path.join(root, item)
+            if os.path.islink(path): os.unlink(path)
+        with (suppress(OSError)): os.rmdir(root)
+
+    return moves
 
 def sigfig(val, n:int = 3):
     """Forces value to specific number of decimal points
@@ -653,10 +1046,11 @@ def sortDigitSuffix(data):
     alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ] 
     return sorted(data, key=alphanum_key)
 
-def importToDataFrame(filename, **kargs):
+def importToDataFrame(filename, cacheDir: str = None, **kargs):
     """Generic importer to Pandas dataframes. Supports .csv, .tsv., .xlsx
     :param filename: The path to the file to import
-    :param **kargs: Additional arguments to the Pandas read function
+    :param cacheDir: Folder to cache converted .xlsx files in. See importXLSX.
+    :param **kargs: Additional arguments to the Pandas read function. Only 'usecols' and 'dtype' are used for .xlsx.
     :return: _description_
     """    
     ext = Path(filename).suffix
@@ -667,13 +1061,317 @@ def importToDataFrame(filename, **kargs):
         case ".csv":
             df = pd.read_csv(filename, **kargs)
         case ".xlsx":
-            df = pd.read_excel(filename, **kargs)
+            df = importXLSX(filename, usecols = kargs.get("usecols"), dtype = kargs.get("dtype"), cacheDir = cacheDir)
         case _:
             df = filename
     
     return df
 
+def selectColumns(header: list[str], usecols = None):
+    """Resolves a Pandas-style 'usecols' against a header
+    :param header: The column names
+    :param usecols: None, a list of names or indices, or a callable that accepts a column name
+    :return: The selected column names, in header order
+    """
+    if usecols is None: return list(header)
+    if callable(usecols): return [col for col in header if usecols(col)]
+    usecols = [header[col] if isinstance(col, int) else col for col in usecols]
+    return [col for col in header if col in usecols]
+
+def dedupeColumns(header: list[str]):
+    """Names columns the way Pandas' parsers do. Empty names become 'Unnamed: i', and repeated names get a counter, 
+    ie. ['val', 'val'] -> ['val', 'val.1']. Named columns are counted before unnamed ones, and a counter is skipped if 
+    the name it gives is already in the header.
+    :param header: The column names, with None for empty ones
+    :return: The unique column names, in header order
+    """
+    cols = [f"Unnamed: {i}" if col is None else col for i, col in enumerate(header)]
+    counts = {}
+    for i in [i for i, col in enumerate(header) if col is not None] + [i for i, col in enumerate(header) if col is None]:
+        col = orig = cols[i]
+        count = counts.get(col, 0)
+        while count > 0:
+            counts[orig] = count + 1
+            col = f"{orig}.{count}"
+            count = count + 1 if col in cols else counts.get(col, 0)
+        cols[i] = col
+        counts[col] = count + 1
+    return cols
+
+def streamXLSX(filename: str, selector):
+    """Reads the first sheet of a workbook row by row straight from its XML, only decoding the selected columns.
+    Cells in other columns are skipped by their reference before their values are looked at, and shared strings are
+    only resolved for the kept cells. Values are read as strings, as with pd.read_excel: dates are formatted as 
+    'YYYY-MM-DD HH:MM:SS', integer-valued numbers lose their trailing '.0', repeated column names are renamed by 
+    dedupeColumns, error cells and Pandas' default NA strings (ie. 'NA', 'N/A', '#N/A', 'null') are missing, and blank 
+    rows are kept unless they are at the end.
+    :param filename: The path to the .xlsx file
+    :param selector: A callable that receives the header and returns the column names to keep
+    :return: The header and a DataFrame of the selected columns
+    """
+    import zipfile, posixpath, xml.etree.ElementTree as ET
+    from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+    from openpyxl.utils.datetime import from_excel, from_ISO8601, WINDOWS_EPOCH, MAC_EPOCH
+    from openpyxl.utils.cell import column_index_from_string
+    from pandas._libs.parsers import STR_NA_VALUES
+
+    with zipfile.ZipFile(filename) as zf:
+        names = set(zf.namelist())
+        workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+        ns = workbook.tag[:workbook.tag.index("}") + 1] if workbook.tag.startswith("{") else ""
+        (ROW, VALUE, INLINE, TEXT, RUN, DIMENSION, SI) = (ns + tag for tag in ("row", "v", "is", "t", "r", "dimension", "si"))
+
+        # Find the first sheet, the shared strings and the styles through the workbook's relationships
+        targets = {}
+        if "xl/_rels/workbook.xml.rels" in names:
+            for rel in ET.fromstring(zf.read("xl/_rels/workbook.xml.rels")):
+                target = rel.get("Target", "")
+                target = target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+                targets[rel.get("Id")] = targets.setdefault(rel.get("Type", "").rsplit("/", 1)[-1], target)
+        sheet = workbook.find(f"{ns}sheets/{ns}sheet")
+        relId = next((val for key, val in (sheet.attrib.items() if sheet is not None else ()) if key.endswith("}id")), None)
+        sheetPath = targets.get(relId, "xl/worksheets/sheet1.xml")
+        stringsPath = targets.get("sharedStrings", "xl/sharedStrings.xml")
+        stylesPath = targets.get("styles", "xl/styles.xml")
+        props = workbook.find(ns + "workbookPr")
+        epoch = MAC_EPOCH if props is not None and props.get("date1904") in ("1", "true") else WINDOWS_EPOCH
+
+        # Index the styles that format numbers as dates
+        dateStyles, deltaStyles = set(), set()
+        if stylesPath in names:
+            styles = ET.fromstring(zf.read(stylesPath))
+            custom = {fmt.get("numFmtId"): fmt.get("formatCode") for fmt in styles.iter(ns + "numFmt")}
+            xfs = styles.find(ns + "cellXfs")
+            for idx, xf in enumerate(xfs if xfs is not None else ()):
+                fmtId = xf.get("numFmtId", "0")
+                fmt = custom[fmtId] if fmtId in custom else builtin_format_code(int(fmtId))
+                if is_date_format(fmt): dateStyles.add(str(idx))
+                if is_timedelta_format(fmt): deltaStyles.add(str(idx))
+
+        def text(node):
+            # Joins the text runs of a string, skipping phonetic hints
+            if node is None: return None
+            return "".join(child.text or "" if child.tag == TEXT else "".join(t.text or "" for t in child.iter(TEXT))
+                           for child in node if child.tag in (TEXT, RUN))
+
+        def stringItems():
+            if stringsPath not in names: return
+            with zf.open(stringsPath) as f:
+                for _, node in ET.iterparse(f):
+                    if node.tag == SI: yield node
+
+        # The shared strings are read once, in order, and only as far as needed. Every string read while looking up
+        # the header is kept (the header's strings are usually first), after that only the wanted ones are.
+        strings = {}
+        items = stringItems()
+        read = 0
+        def readStrings(wanted: set, keepAll: bool = False):
+            nonlocal read
+            last = max(wanted, default = -1)
+            if read > last: return
+            for node in items:
+                if keepAll or read in wanted: strings[read] = text(node)
+                node.clear()
+                read += 1
+                if read > last: break
+
+        def decode(cell):
+            # Converts a cell to a string. Shared strings are returned as their int index and resolved later.
+            typ = cell.get("t", "n")
+            if typ == "inlineStr": return text(cell.find(INLINE))
+            val = cell.findtext(VALUE) or None
+            if val is None: return None
+            if typ == "n":
+                num = float(val) if "." in val or "E" in val or "e" in val else int(val)
+                style = cell.get("s")
+                if style in dateStyles:
+                    with suppress(OverflowError, ValueError): return str(from_excel(num, epoch, timedelta = style in deltaStyles))
+                if isinstance(num, float) and num.is_integer(): num = int(num)
+                return str(num)
+            if typ == "s": return int(val)
+            if typ == "b": return str(bool(int(val)))
+            if typ == "d": return str(from_ISO8601(val))
+            if typ == "e": return None
+            return val
+
+        # The 0-based column of each cell reference's letters, ie. 'AB12' -> 'AB' -> 27
+        columns = {}
+        def column(ref):
+            letters = ref.rstrip("0123456789")
+            if letters not in columns: columns[letters] = column_index_from_string(letters) - 1
+            return columns[letters]
+
+        width = 0
+        header = None
+        rowNum = 0
+        with zf.open(sheetPath) as f:
+            for _, node in ET.iterparse(f):
+                tag = node.tag
+                if tag == DIMENSION:
+                    width = column(node.get("ref", "A1").split(":")[-1]) + 1
+                if tag != ROW: continue
+                col = -1
+                last, rowNum = rowNum, int(node.get("r") or rowNum + 1)
+                if header is None:
+                    cells = {}
+                    for cell in node:
+                        ref = cell.get("r")
+                        col = column(ref) if ref else col + 1
+                        cells[col] = decode(cell)
+                    readStrings({val for val in cells.values() if isinstance(val, int)}, keepAll = True)
+                    header = [None] * max(width, max(cells, default = -1) + 1)
+                    for col, val in cells.items(): header[col] = strings[val] if isinstance(val, int) else val
+                    header = dedupeColumns(header)
+                    cols = selector(header)
+                    index = {col: i for i, col in enumerate(header)}
+                    keep = {index[col]: pos for pos, col in enumerate(cols)}
+                    data = [[] for _ in cols]
+                    wanted = set()
+                    blank = 0
+                else:
+                    row = [None] * len(cols)
+                    for cell in node:
+                        # Skip the cells of other columns before looking at their values
+                        ref = cell.get("r")
+                        if ref: 
+                            col = columns.get(ref.rstrip("0123456789"))
+                            if col is None: col = column(ref)
+                        else:
+                            col += 1
+                        pos = keep.get(col)
+                        if pos is None: continue
+                        val = decode(cell)
+                        if isinstance(val, int): wanted.add(val)
+                        elif val in STR_NA_VALUES: val = None
+                        row[pos] = val
+                    # Blank and left out rows are kept as missing values like pd.read_excel, unless they are at the end.
+                    # Only look at the other cells if none of the selected ones had a value.
+                    blank += rowNum - last - 1
+                    if any(val is not None for val in row) or any(len(cell) for cell in node):
+                        for vals, val in zip(data, row): vals.extend([None] * blank + [val])
+                        blank = 0
+                    else:
+                        blank += 1
+                node.clear()
+
+        if header is None: 
+            items.close()
+            return [], pd.DataFrame(columns = selector([]))
+        readStrings(wanted)
+        items.close()
+        for idx in wanted:
+            if strings[idx] in STR_NA_VALUES: strings[idx] = None
+        if strings: data = [[strings[val] if isinstance(val, int) else val for val in vals] for vals in data]
+    return header, pd.DataFrame(dict(zip(cols, data)), columns = cols)
+
+def importXLSX(filename: str, usecols = None, dtype = None, cacheDir: str = None):
+    """Imports a .xlsx file by streaming only the requested columns. If cacheDir is set, the columns read are cached 
+    as a Parquet file keyed by the workbook's modification time and size. Later reads load from the cache, re-reading 
+    the workbook only if it changed or new columns are requested.
+    :param filename: The path to the .xlsx file
+    :param usecols: Columns to import. See selectColumns.
+    :param dtype: The dtype to convert the columns to, defaults to strings
+    :param cacheDir: Folder to cache converted files in, defaults to None (no caching)
+    :return: A DataFrame
+    """
+    import hashlib, json, pyarrow as pa, pyarrow.parquet as pq
+
+    cacheFile = None
+    cachedCols = []
+    if cacheDir is not None:
+        stat = os.stat(filename)
+        fileKey = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+        pathHash = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:16]
+        cacheFile = os.path.join(cacheDir, f"{Path(filename).stem}.{pathHash}.parquet")
+        if os.path.isfile(cacheFile):
+            schema = pq.read_schema(cacheFile)
+            meta = schema.metadata or {}
+            if json.loads(meta.get(b"source", b"{}")) == fileKey:
+                cols = selectColumns(json.loads(meta[b"header"]), usecols)
+                if set(cols).issubset(schema.names):
+                    return convertDtype(pd.read_parquet(cacheFile, columns = cols), dtype)
+                cachedCols = schema.names
+
+    # Read any cached columns as well so the cache keeps growing rather than being replaced
+    def selector(header):
+        wanted = set(selectColumns(header, usecols)).union(cachedCols)
+        return [col for col in header if col in wanted]
+    header, df = streamXLSX(filename, selector)
+
+    if cacheFile is not None:
+        Path(cacheDir).mkdir(parents = True, exist_ok = True)
+        table = pa.Table.from_pandas(df, preserve_index = False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), 
+                                               b"source": json.dumps(fileKey).encode(), 
+                                               b"header": json.dumps(header).encode()})
+        pq.write_table(table, cacheFile)
+
+    return convertDtype(df[selectColumns(header, usecols)], dtype)
+
+def convertDtype(df: pd.DataFrame, dtype = None):
+    """Converts the string columns from importXLSX to a dtype. Missing values are kept as missing.
+    :param df: The DataFrame of strings
+    :param dtype: The dtype, or a dict of column to dtype
+    :return: The converted DataFrame
+    """
+    if dtype is None or dtype in (str, "str", object, "object"): return df
+    if isinstance(dtype, dict): dtype = {col: typ for col, typ in dtype.items() if col in df.columns}
+    return df.astype(dtype)
+
+def generatePathTrie(pathMap: dict):
+    """Generates a prefix trie for remapping paths
+    :param pathMap: A dict of path prefixes to their replacements
+    :return: The trie, as nested dicts keyed by character. Replacements are stored under the key None.
+    """
+    trie = {}
+    for prefix, replacement in pathMap.items():
+        node = trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = replacement
+    return trie
+
+def remapPath(path: str, trie: dict):
+    """Replaces the longest matching prefix of a path. Prefixes only match whole path components, so '/mnt/data' 
+    matches '/mnt/data' and '/mnt/data/run1' but not '/mnt/data2'. If the replacement only uses '\\' as a separator 
+    (ie. a Windows path), the separators in the rest of the path are converted too.
+    :param path: The path to remap
+    :param trie: The trie generated by generatePathTrie
+    :return: The remapped path, or the original path if no prefix matched
+    """
+    seps = ("/", "\\")
+    node = trie
+    match = None
+    for idx, char in enumerate(path):
+        if None in node and (char in seps or path[idx - 1:idx] in seps): match = (idx, node[None])
+        node = node.get(char)
+        if node is None: break
+    else:
+        if None in node: match = (len(path), node[None])
+    if match is None: return path
+    (idx, replacement) = match
+    rest = path[idx:]
+    if "\\" in replacement and "/" not in replacement: rest = rest.replace("/", "\\")
+    return replacement + rest
+
+def remapPaths(paths: list[str], pathMap):
+    """Remaps the prefixes of a list of paths, such as paths read from a flat file database created on another host.
+    Used instead of rewriting the database, so the same database can be used from any host.
+    :param paths: The paths to remap
+    :param pathMap: A dict of path prefixes to their replacements, or a trie generated by generatePathTrie
+    :return: The remapped paths
+    """
+    if not pathMap: return paths
+    trie = pathMap if isinstance(next(iter(pathMap.values())), dict) else generatePathTrie(pathMap)
+    return [remapPath(path, trie) for path in paths]
+
 def convertLinuxDBtoWindows(dbPath, newPath, replace):
+    """Rewrites a flat file database, replacing strings in every path. Superseded by the 'pathMap' of searchFlatFileDB, 
+    which remaps paths as they are read instead of keeping a second copy of the database.
+    :param dbPath: The path to the flat file database
+    :param newPath: The path to the new database
+    :param replace: A list of (old, new) strings to replace
+    """
     with open(dbPath,'r') as oldDB:
         with open(newPath,'w') as newDB:
             for line in oldDB:
@@ -14,8 +14,10 @@ setup(
     install_requires=[
         "alive_progress==3.1.1",
         "numpy==1.24.2",
+        "openpyxl==3.1.2",
         "pandas==2.0.0",
         "pyahocorasick==2.0.0",
+        "pyarrow==11.0.0",
         "pytest==7.3.0",
         "requests==2.28.2",
     ],
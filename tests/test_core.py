@@ -0,0 +1,34 @@
+import pandas as pd
+import covid_nextstrain_collector.core as core
+
+def test_filterRows_inputs_sharing_an_output():
+    cols = {"Key": "accession", "ACC": "accession", "collection_date": "date"}
+    rowFilter = {"accession": ["K2"], "date": {"min": "2023-01-01"}}
+    seqData = pd.DataFrame({"Key": ["K1", "K2", "K3"], "collection_date": ["2023-02-01"] * 3})
+    patientData = pd.DataFrame({"ACC": ["K1", "K2"], "date": ["2022-12-01", "2023-02-01"]})
+    assert core.filterRows(seqData, rowFilter, cols)["Key"].tolist() == ["K2"]
+    assert core.filterRows(patientData, rowFilter, cols)["ACC"].tolist() == ["K2"]
+
+def test_filterRows_ignores_missing_columns():
+    df = pd.DataFrame({"Key": ["K1", "K2"]})
+    assert core.filterRows(df, {"region": ["North"]}, {"Key": "accession"})["Key"].tolist() == ["K1", "K2"]
+
+def test_externalSortRecords_matches_sortRecords(tmp_path):
+    df = pd.DataFrame({"date": pd.to_datetime(["2023-01-03", None, "2023-01-01", "2023-01-03", "2023-01-02", "2023-01-01", None]),
+                       "strain": pd.array(["c", "a", "b", None, "e", "a", "d"], dtype = "string[pyarrow]"),
+                       "region": pd.Categorical(["N", "S", "N", "E", "S", "W", "N"]),
+                       "n": range(7)})
+    expected = core.sortRecords(df, ["date", "strain"])
+    for maxRows, chunksize in [(3, 2), (2, 3), (7, 10), (1, 1)]:
+        path = core.externalSortRecords(df, str(tmp_path / "sorted.parquet"), ["date", "strain"], maxRows = maxRows, chunksize = chunksize)
+        assert core.countRecords(path) == len(df)
+        result = pd.concat(core.iterRecords(path, chunksize = 4), ignore_index = True).astype(df.dtypes.to_dict())
+        pd.testing.assert_frame_equal(result, expected)
+
+def test_writeMetadata_from_sorted_file(tmp_path):
+    df = pd.DataFrame({"strain": ["b", "a", "c"], "date": ["2023-01-02", "2023-01-01", "2023-01-02"]})
+    core.writeMetadata(str(tmp_path / "memory.tsv"), core.sortRecords(df, ["date", "strain"]), chunksize = 2)
+    path = core.externalSortRecords(df, str(tmp_path / "sorted.parquet"), ["date", "strain"], maxRows = 1)
+    core.writeMetadata(str(tmp_path / "disk.tsv"), path, chunksize = 2)
+    for ext in ["", ".idx"]:
+        assert (tmp_path / f"memory.tsv{ext}").read_bytes() == (tmp_path / f"disk.tsv{ext}").read_bytes()
@@ -0,0 +1,88 @@
+import datetime, zipfile
+import openpyxl, pandas as pd, pytest
+import covid_nextstrain_collector.searchTools as st
+
+def readExcel(path, usecols = None):
+    """pd.read_excel with missing values as None, as returned by streamXLSX"""
+    df = pd.read_excel(path, usecols = usecols, dtype = str)
+    return df.astype(object).where(df.notna(), None)
+
+@pytest.fixture
+def inlineWorkbook(tmp_path):
+    """A workbook as written by openpyxl, which stores strings inline"""
+    path = tmp_path / "inline.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["id", "val", "val", None, "date", "n", "flag", "val.1"])
+    ws.append(["A1", "x", "y", "hidden", datetime.datetime(2023, 1, 2, 3, 4, 5), 2.0, True, "z"])
+    ws.append(["A2", "NA", "N/A", None, datetime.date(2023, 2, 1), 1.5, False, "null"])
+    ws.append([None] * 8)
+    ws.append(["A3", "#N/A", "", None, None, 3, None, "None"])
+    ws["B6"] = "#DIV/0!"
+    ws["A6"] = "A4"
+    wb.save(path)
+    return path
+
+@pytest.fixture
+def sharedWorkbook(tmp_path):
+    """A minimal workbook using shared strings, as Excel saves them"""
+    path = tmp_path / "shared.xlsx"
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    rel = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    strings = ["id", "val", "A1", "x", "NA", "A2", "y", "null"]
+    rows = [[("s", 0), ("s", 1), ("s", 1)],
+            [("s", 2), ("s", 3), ("s", 4)],
+            [("s", 5), ("e", "#N/A"), ("s", 6)],
+            [("s", 7), ("n", "5"), ("str", "N/A")]]
+    sheet = "".join(f'<row r="{r}">' + "".join(f'<c r="{"ABC"[c]}{r}" t="{t}"><v>{v}</v></c>' if t != "n" else f'<c r="{"ABC"[c]}{r}"><v>{v}</v></c>'
+                                              for c, (t, v) in enumerate(row)) + "</row>" for r, row in enumerate(rows, 1))
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("[Content_Types].xml", '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                    '<Default Extension="xml" ContentType="application/xml"/>'
+                    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                    '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+                    '</Types>')
+        zf.writestr("_rels/.rels", '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                    f'<Relationship Id="rId1" Type="{rel}/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+        zf.writestr("xl/workbook.xml", f'<workbook {ns} xmlns:r="{rel}"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        zf.writestr("xl/_rels/workbook.xml.rels", '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                    f'<Relationship Id="rId1" Type="{rel}/worksheet" Target="worksheets/sheet1.xml"/>'
+                    f'<Relationship Id="rId2" Type="{rel}/sharedStrings" Target="sharedStrings.xml"/></Relationships>')
+        zf.writestr("xl/worksheets/sheet1.xml", f"<worksheet {ns}><sheetData>{sheet}</sheetData></worksheet>")
+        zf.writestr("xl/sharedStrings.xml", f"<sst {ns}>" + "".join(f"<si><t>{s}</t></si>" for s in strings) + "</sst>")
+    return path
+
+@pytest.mark.parametrize("workbook", ["inlineWorkbook", "sharedWorkbook"])
+def test_streamXLSX_matches_read_excel(workbook, request):
+    path = request.getfixturevalue(workbook)
+    expected = readExcel(path)
+    header, df = st.streamXLSX(path, lambda header: header)
+    assert header == list(expected.columns)
+    pd.testing.assert_frame_equal(df, expected)
+
+def test_streamXLSX_repeated_columns(inlineWorkbook):
+    header, df = st.streamXLSX(inlineWorkbook, lambda header: ["val", "val.2", "val.1"])
+    assert header == ["id", "val", "val.2", "Unnamed: 3", "date", "n", "flag", "val.1"]
+    assert df["val"].tolist() == ["x", None, None, None, None]
+    assert df["val.2"].tolist() == ["y", None, None, None, None]
+    assert df["val.1"].tolist() == ["z", None, None, None, None]
+
+def test_dedupeColumns():
+    assert st.dedupeColumns(["x", "y", "x", "x"]) == ["x", "y", "x.1", "x.2"]
+    assert st.dedupeColumns(["a", None, "a", "a.1", None]) == ["a", "Unnamed: 1", "a.2", "a.1", "Unnamed: 4"]
+
+def test_importXLSX_usecols_and_cache(inlineWorkbook, tmp_path):
+    cols = ["id", "val.1", "date"]
+    expected = readExcel(inlineWorkbook, usecols = cols)
+    pd.testing.assert_frame_equal(st.importXLSX(inlineWorkbook, usecols = cols), expected)
+    for _ in range(2):
+        pd.testing.assert_frame_equal(st.importXLSX(inlineWorkbook, usecols = cols, cacheDir = tmp_path / "cache"), expected)
+
+def test_remapPaths_matches_whole_components():
+    pathMap = {"/mnt/data": "/srv/data", "/mnt/data/runs/": "/fast/runs/", "/mnt/win": "Z:\\win"}
+    paths = ["/mnt/data", "/mnt/data/a.fasta", "/mnt/data2/a.fasta", "/mnt/data/runs/r1/a.fasta", "/mnt/data/runs2/a.fasta", 
+             "/mnt/win/r1/a.fasta", "/mnt/windows/r1/a.fasta", "/other/a.fasta"]
+    assert st.remapPaths(paths, pathMap) == ["/srv/data", "/srv/data/a.fasta", "/mnt/data2/a.fasta", "/fast/runs/r1/a.fasta", 
+                                             "/srv/data/runs2/a.fasta", "Z:\\win\\r1\\a.fasta", "/mnt/windows/r1/a.fasta", "/other/a.fasta"]